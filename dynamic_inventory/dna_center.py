@@ -13,6 +13,7 @@ DOCUMENTATION = r'''
         - Adds inventory to ansible working inventory
     extends_documentation_fragment:
         - constructed
+        - inventory_cache
     options:
         plugin:  
             description: Name of the plugin
@@ -52,6 +53,11 @@ DOCUMENTATION = r'''
         api_record_limit:
             description: DNAC API calls return maximum of <api_record_limit> records per invocation. Defaults to 500 records
             required: true
+        api_page_workers:
+            description: Maximum number of device list pages requested from DNAC concurrently
+            required: false
+            type: int
+            default: 8
         hostname_filter:
             description: DNAC search query based on hostname
             required: false
@@ -64,6 +70,11 @@ DOCUMENTATION = r'''
         location_name:
             descriotion: DNAC location name
             required: false
+        expose_raw_host_data:
+            description: add the complete DNAC device record to each host as the `host_data` variable
+            required: false
+            default: false
+            choices: [true, false]
 '''
 
 EXAMPLES = r'''
@@ -75,11 +86,13 @@ EXAMPLES = r'''
 from ansible.errors import AnsibleError, AnsibleParserError
 from ansible.module_utils._text import to_bytes, to_native
 from ansible.parsing.utils.addresses import parse_address
-from ansible.plugins.inventory import BaseInventoryPlugin, Constructable
+from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
 
+import hashlib
 import json
 import sys
-import math 
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try: 
     import requests, urllib3
@@ -88,7 +101,40 @@ try:
 except ImportError as e:
     raise AnsibleError('Python requests module is required for this plugin. Error: %s' % to_native(e))
 
-class InventoryModule(BaseInventoryPlugin, Constructable):
+# transient device list page failures are retried with exponential backoff
+_PAGE_RETRIES = 3
+_PAGE_RETRY_BACKOFF = 1
+
+# characters in DNAC site names that are not valid in ansible group names
+_SPECIAL_CHAR_MAP = str.maketrans({ 'ä':'ae', 'ü':'ue', 'ö':'oe', 'ß':'ss', '(':'_', ')':'_', ' ': '_', '-':'_', '.': '_' })
+
+# DNAC device families that are not inventorized
+_AP_FAMILIES = frozenset(['Unified AP'])
+
+# connection variables for each supported network os
+_IOS_VARS = {
+    'ansible_network_os': 'ios',
+    'ansible_connection': 'network_cli',
+    'ansible_become': 'yes',
+    'ansible_become_method': 'enable'
+}
+_NXOS_VARS = {
+    'ansible_network_os': 'nxos',
+    'ansible_connection': 'network_cli',
+    'ansible_become': 'yes',
+    'ansible_become_method': 'enable'
+}
+
+# lowercased DNAC softwareType to connection variables
+_OS_PROFILE = {
+    'ios': _IOS_VARS,
+    'ios-xe': _IOS_VARS,
+    'unified ap': _IOS_VARS,
+    'nxos': _NXOS_VARS,
+    'nx-os': _NXOS_VARS
+}
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
 
     NAME = 'dna_center'
 
@@ -104,14 +150,17 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
         self.use_dnac_mgmt_int = None
         self.toplevel = None
         self.api_record_limit = 500
+        self.api_page_workers = 8
         self.hostname_filter = None
         self.device_family = None
         self.location_name = None
+        self.expose_raw_host_data = False
         
         # global attributes 
         self._site_list = None
+        self._siteid_to_name = None
+        self._device_to_siteid = None
         self._inventory = []
-        self._host_list = None
         self._dnac_api = None
 
     def _login(self):
@@ -131,70 +180,121 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
                 verify=self.validate_certs)
         except ApiError as e:
             raise AnsibleError('failed to login to DNA Center: %s' % to_native(e))
-            
-            return self._dnac_api
 
-    def _get_inventory(self):
-        '''
-            :return The json output from the request object response. 
-        '''
+        # the SDK reuses one requests session for all calls; size its connection
+        # pool so every concurrent request keeps a kept-alive connection. Up to
+        # api_page_workers device list pages run alongside the site and
+        # physical topology requests
+        req_session = getattr(self._dnac_api._session, '_req_session', None)
+        if req_session is not None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=max(requests.adapters.DEFAULT_POOLSIZE, self.api_page_workers + 2))
+            req_session.mount('https://', adapter)
 
-        try:
-            device_count = (self._dnac_api.devices.get_device_count()).response
-        except ApiError as e: 
-            raise AnsibleParserError('Getting device count failed:  %s' % to_native(e))
+        return self._dnac_api
 
-        # calculate the number of API calls (ie pages) in case if device count
-        # exceeds the api_record_limit
-        offset_pages = math.ceil(device_count / self.api_record_limit)
+    def _get_inventory_page(self, offset):
+        '''
+            :param offset: The zero based page number of the device list.
+            :return The list of devices on the requested page.
+        '''
 
-        for offset in range(offset_pages):
-            # DNAC API takes starting index of a device in a list
-            # beginning with index of '1'
-            start_index = offset * self.api_record_limit + 1
+        # DNAC API takes starting index of a device in a list
+        # beginning with index of '1'
+        start_index = offset * self.api_record_limit + 1
+        for attempt in range(_PAGE_RETRIES + 1):
             try:
-                inventory_results = (self._dnac_api.devices.get_device_list(
+                return (self._dnac_api.devices.get_device_list(
                     limit=self.api_record_limit, 
                     offset=start_index,
                     hostname=self.hostname_filter,
                     family=self.device_family,
                     location_name=self.location_name).response)
             except ApiError as e:
-                raise AnsibleParserError('Getting device inventory failed:  %s' % to_native(e))
+                # client errors will not succeed on a retry
+                if (e.status_code or 0) < 500 or attempt == _PAGE_RETRIES:
+                    raise AnsibleParserError('Getting device inventory failed:  %s' % to_native(e))
+            except requests.exceptions.RequestException as e:
+                if attempt == _PAGE_RETRIES:
+                    raise AnsibleParserError('Getting device inventory failed:  %s' % to_native(e))
 
-            self._inventory = [*self._inventory, *inventory_results]
+            time.sleep(_PAGE_RETRY_BACKOFF * 2 ** attempt)
 
-        return self._inventory
+    def _get_device_count(self):
+        '''
+            :return The number of devices managed by DNA Center.
+        '''
+
+        try:
+            return (self._dnac_api.devices.get_device_count()).response
+        except ApiError as e: 
+            raise AnsibleParserError('Getting device count failed:  %s' % to_native(e))
 
-    def _get_hosts(self):
+    def _get_inventory(self):
         '''
-             :param inventory A list of dictionaries representing the entire DNA Center inventory. 
-             :return A List of tuples that include the management IP, device hostnanme, and the unique indentifier of the device.
+            :return The json output from the request object response. 
         '''
 
-        host_list = []
+        # the device list response does not carry the total device count, so
+        # request the first page together with the count instead of after it
+        with ThreadPoolExecutor(max_workers=self.api_page_workers) as executor:
+            device_count_future = executor.submit(self._get_device_count)
+            first_page_future = executor.submit(self._get_inventory_page, 0)
+
+            device_count = device_count_future.result()
+
+            # no devices need no device list; the first page is not sent if
+            # it is still queued and its result is ignored otherwise
+            if device_count == 0:
+                first_page_future.cancel()
+                self._inventory = []
+                return self._inventory
+
+            # calculate the number of API calls (ie pages) in case if device count
+            # exceeds the api_record_limit
+            offset_pages = -(-device_count // self.api_record_limit)
+
+            # the remaining pages are independent of each other, so request them
+            # concurrently; executor.map returns the pages in offset order
+            pages = [first_page_future.result()]
+            if offset_pages > 1:
+                pages.extend(executor.map(self._get_inventory_page, range(1, offset_pages)))
+
+        self._inventory = []
+        for inventory_results in pages:
+            self._inventory.extend(inventory_results)
+
+        return self._inventory
+
+    def _iter_hosts(self):
+        '''
+             :return A generator of dictionaries that include the management IP, device hostname, and the unique identifier of each device in the DNA Center inventory.
+        '''
 
         for host in self._inventory: 
             # do not inventorize Access Points
-            if host['family'].find('Unified AP') == -1: 
-                host_dict = {}
-                host_dict.update({
-                    'managementIpAddress': host['managementIpAddress'],
-                    'hostname' : host['hostname'],
-                    'id': host['id'],
-                    'os': (host['softwareType'] if host['family'].find('Unified AP') == -1 else host['family']), 
-                    'version': host['softwareVersion'], 
-                    'reachabilityStatus': host['reachabilityStatus'],
-                    'role': host['role'],
-                    'serialNumber': host['serialNumber'].split(', '),
-                    'series': host['series'],
-                    'host_data': host
-                })
-                host_list.append(host_dict)
-        
-        self._host_list = host_list
-        
-        return host_list
+            if host['family'] in _AP_FAMILIES:
+                continue
+
+            # stacked devices report a comma separated list of serial numbers
+            serial_number = host['serialNumber']
+            serial_numbers = serial_number.split(', ') if ', ' in serial_number else [serial_number]
+
+            host_dict = {
+                'managementIpAddress': host['managementIpAddress'],
+                'hostname' : host['hostname'],
+                'id': host['id'],
+                'os': host['softwareType'], 
+                'version': host['softwareVersion'], 
+                'reachabilityStatus': host['reachabilityStatus'],
+                'role': host['role'],
+                'serialNumber': serial_numbers,
+                'series': host['series']
+            }
+            if self.expose_raw_host_data:
+                host_dict['host_data'] = host
+
+            yield host_dict
 
     def _get_sites(self):
         '''
@@ -211,8 +311,7 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
 
         for site in sites: 
 
-            special_char_map = { ord('ä'):'ae', ord('ü'):'ue', ord('ö'):'oe', ord('ß'):'ss', ord('('):'_', ord(')'):'_', ord(' '): '_', ord('-'):'_', ord('.'): '_' }
-            normalized_site_name = site['name'].translate(special_char_map).lower()
+            normalized_site_name = site['name'].translate(_SPECIAL_CHAR_MAP).lower()
             
             site_dict = {}
             if(site['locationType'] == 'building'):
@@ -222,35 +321,37 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
             site_list.append(site_dict)
         
         self._site_list = site_list
+        self._siteid_to_name = { site['id']: site['name'] for site in site_list }
         
         return site_list
 
 
-    def _get_member_site(self, device_id):
+    def _get_physical_topology(self):
         '''
-            :param device_id: The unique identifier of the target device.
-            :return A single string representing the name of the SITE group of which the device is a member.
+            :return A dictionary mapping the unique ID of each device to the unique ID of its site.
         '''
 
         try:
             devices = (self._dnac_api.topology.get_physical_topology()).response.nodes
         except ApiError as e:
-            raise AnsibleError('Getting member site failed: %s' % to_native(e))
-        
-        # Get the one device we are looking for
-        device = [ dev for dev in devices if dev['id'] == device_id ][0]
+            raise AnsibleError('Getting physical topology failed: %s' % to_native(e))
 
-        # Extract the siteid from the device data 
-        site_id = device.get('additionalInfo').get('siteid')
-        
-        # set the site name from the self._site_list
-        site_name = [ site['name'] for site in self._site_list if site['id'] == site_id ]
+        # Extract the siteid from the device data once for all devices; nodes
+        # that are not inventorized (cloud, unknown, APs) may lack additionalInfo
+        self._device_to_siteid = { dev['id']: (dev.get('additionalInfo') or {}).get('siteid') for dev in devices }
+
+        return self._device_to_siteid
+
+    def _get_member_site(self, device_id):
+        '''
+            :param device_id: The unique identifier of the target device.
+            :return A single string representing the name of the SITE group of which the device is a member.
+        '''
+
+        site_id = self._device_to_siteid.get(device_id)
 
         # return the name if it exists
-        if len(site_name) == 1:
-            return site_name[0]
-        elif len(site_name) == 0: 
-            return 'ungrouped'
+        return self._siteid_to_name.get(site_id, 'ungrouped')
             
 
     def _add_sites(self):
@@ -258,79 +359,103 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
             :param site_list: list of group dictionaries containing name, id, parentId
         '''
             
-        # Global is a system group and the parent of all top level groups
-        site_ids = [ ste['id'] for ste in self._site_list ]
-        parent_name = ''
-
         if self.toplevel:
             self.inventory.add_group(self.toplevel)
         
-        # Add all sites
+        # Add all sites and their parent/child relationship in one pass.
+        # add_group is a no-op for existing groups, so adding the parent here
+        # keeps add_child valid without ordering the site list first
         for site in self._site_list: 
             self.inventory.add_group(site['name'])
 
-        # Add parent/child relationship
-        for site in self._site_list: 
-            
-            if site['parentId'] in site_ids:
-                parent_name = [ ste['name'] for ste in self._site_list if ste['id'] == site['parentId'] ][0]
+            # Global is a system group and the parent of all top level groups;
+            # it is not in the site map, so top level sites go under toplevel
+            parent_name = self._siteid_to_name.get(site['parentId'], self.toplevel)
+            if parent_name:
                 try: 
+                    self.inventory.add_group(parent_name)
                     self.inventory.add_child(parent_name, site['name'])
                 except Exception as e:
                     raise AnsibleParserError('adding child sites failed:  {} \n {}:{}'.format(e,site['name'],parent_name))
-            elif self.toplevel:
-                try: 
-                    self.inventory.add_child(self.toplevel, site['name'])
-                except Exception as e:
-                    raise AnsibleParserError('adding child sites failed:  {} \n {}:{}'.format(e,site['name'],parent_name))
-                
 
 
     def _add_hosts(self):
         """
             Add the devicies from DNAC Inventory to the Ansible Inventory
-            :param host_list: list of dictionaries for hosts retrieved from DNAC
 
         """
-        for h in self._host_list: 
-            site_name = self._get_member_site( h['id'] )
+        compose = self.get_option('compose')
+        groups = self.get_option('groups')
+        keyed_groups = self.get_option('keyed_groups')
+        strict = self.strict
+        use_dnac_mgmt_int = self.use_dnac_mgmt_int
+
+        # bind methods used for every host once outside of the loop
+        get_member_site = self._get_member_site
+        add_host = self.inventory.add_host
+        get_host = self.inventory.get_host
+        set_composite_vars = self._set_composite_vars
+        add_host_to_composed_groups = self._add_host_to_composed_groups
+        add_host_to_keyed_groups = self._add_host_to_keyed_groups
+
+        for h in self._iter_hosts(): 
+            site_name = get_member_site( h['id'] )
             if site_name:
-                host_name = self.inventory.add_host(h['hostname'], group=site_name)
+                host_name = add_host(h['hostname'], group=site_name)
+                host_obj = get_host(host_name)
                 
                 #  add variables to the hosts
-                if self.use_dnac_mgmt_int:
-                    self.inventory.set_variable(host_name,'ansible_host',h['managementIpAddress'])
-
-                self.inventory.set_variable(host_name, 'os', h['os'])
-                self.inventory.set_variable(host_name, 'version', h['version'])
-                self.inventory.set_variable(host_name, 'reachability_status', h['reachabilityStatus'])
-                self.inventory.set_variable(host_name, 'serial_number', h['serialNumber'])
-                self.inventory.set_variable(host_name, 'hw_type', h['series'])
-                # DNAC API calls operate on id of each managed element
-                self.inventory.set_variable(host_name, 'id', h['id'])
-                self.inventory.set_variable(host_name, 'site', site_name)
-                self.inventory.set_variable(host_name, 'host_data', h['host_data'])
-
-                if h['os'].lower() in ['ios', 'ios-xe', 'unified ap']:
-                    self.inventory.set_variable(host_name, 'ansible_network_os', 'ios')
-                    self.inventory.set_variable(host_name, 'ansible_connection', 'network_cli')
-                    self.inventory.set_variable(host_name, 'ansible_become', 'yes')
-                    self.inventory.set_variable(host_name, 'ansible_become_method', 'enable')
-                elif h['os'].lower() in ['nxos','nx-os']:
-                    self.inventory.set_variable(host_name, 'ansible_network_os', 'nxos')
-                    self.inventory.set_variable(host_name, 'ansible_connection', 'network_cli')
-                    self.inventory.set_variable(host_name, 'ansible_become', 'yes')
-                    self.inventory.set_variable(host_name, 'ansible_become_method', 'enable')
+                if use_dnac_mgmt_int:
+                    host_obj.vars['ansible_host'] = h['managementIpAddress']
+
+                host_obj.vars.update({
+                    'os': h['os'],
+                    'version': h['version'],
+                    'reachability_status': h['reachabilityStatus'],
+                    'serial_number': h['serialNumber'],
+                    'hw_type': h['series'],
+                    # DNAC API calls operate on id of each managed element
+                    'id': h['id'],
+                    'site': site_name
+                })
+                if 'host_data' in h:
+                    host_obj.vars['host_data'] = h['host_data']
+
+                profile = _OS_PROFILE.get(h['os'].lower())
+                if profile:
+                    host_obj.vars.update(profile)
             
-                self._set_composite_vars(self.get_option('compose'), self.inventory.get_host(host_name).get_vars(), host_name, self.strict)
-                self._add_host_to_composed_groups(self.get_option('groups'), dict(), host_name, self.strict)
-                self._add_host_to_keyed_groups(self.get_option('keyed_groups'), dict(), host_name, self.strict)
+                # get_vars() also carries magic vars such as inventory_hostname
+                # that compose expressions may reference
+                set_composite_vars(compose, host_obj.get_vars(), host_name, strict)
+                add_host_to_composed_groups(groups, dict(), host_name, strict)
+                add_host_to_keyed_groups(keyed_groups, dict(), host_name, strict)
             else:
                 raise AnsibleError('no site name found for host: {} with site_id {}'.format(h['id'], self._site_list))
 
 
 
 
+    def _get_dnac_cache_key(self, path):
+        '''
+            :param path: The path of the inventory config file.
+            :return The cache key for the DNAC data selected by the current options.
+        '''
+
+        # host and filters may come from the environment rather than the config
+        # file, so they are part of the key in addition to the file path
+        dnac_query = json.dumps([
+            self.host,
+            self.dnac_version,
+            self.api_record_limit,
+            self.hostname_filter,
+            self.device_family,
+            self.location_name
+        ])
+
+        return '{0}_{1}'.format(self.get_cache_key(path), hashlib.sha1(to_bytes(dnac_query)).hexdigest()[:10])
+
+
     def verify_file(self, path):
         
         ''' return true/false if this is possibly a valid file for this plugin to consume '''
@@ -360,23 +485,60 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
             self.validate_certs = self.get_option('validate_certs')
             self.toplevel = self.get_option('toplevel')
             self.api_record_limit = self.get_option('api_record_limit')
+            self.api_page_workers = self.get_option('api_page_workers')
             self.strict = self.get_option('strict')
             self.hostname_filter = self.get_option('hostname_filter')
             self.device_family = self.get_option('device_family')
             self.location_name = self.get_option('location_name')
+            self.expose_raw_host_data = self.get_option('expose_raw_host_data')
         except Exception as e: 
             raise AnsibleParserError('getting options failed:  %s' % to_native(e))
 
-        # Attempt login to DNAC
-        self._login()
+        if self.api_page_workers < 1:
+            raise AnsibleParserError('api_page_workers must be at least 1, got %s' % self.api_page_workers)
+
+        # DNAC data is read from the inventory cache when it is enabled and
+        # only fetched from DNAC on a cache miss or an explicit refresh
+        cache_key = self._get_dnac_cache_key(path)
+        user_cache_setting = self.get_option('cache')
+        attempt_to_read_cache = user_cache_setting and cache
+        cache_needs_update = user_cache_setting and not cache
+
+        if attempt_to_read_cache:
+            try:
+                cached_data = self._cache[cache_key]
+                self._inventory = cached_data['inventory']
+                self._site_list = cached_data['site_list']
+                self._device_to_siteid = cached_data['device_to_siteid']
+                self._siteid_to_name = cached_data['siteid_to_name']
+            except KeyError:
+                cache_needs_update = True
+
+        if not attempt_to_read_cache or cache_needs_update:
+            # Attempt login to DNAC
+            self._login()
+
+            # Obtain Inventory Data; the device list, site topology and
+            # physical topology are independent, so fetch them concurrently
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(self._get_inventory),
+                    executor.submit(self._get_sites),
+                    executor.submit(self._get_physical_topology)
+                ]
+                for future in futures:
+                    future.result()
+
+        if cache_needs_update:
+            self._cache[cache_key] = {
+                'inventory': self._inventory,
+                'site_list': self._site_list,
+                'device_to_siteid': self._device_to_siteid,
+                'siteid_to_name': self._siteid_to_name
+            }
 
-        # Obtain Inventory Data
-        self._get_inventory()
-      
         # Add groups to the inventory 
-        self._get_sites()
         self._add_sites()
         
         # Add the hosts to the inventory 
-        self._get_hosts()
-        self._add_hosts()
\ No newline at end of file
+        self._add_hosts()